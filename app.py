@@ -1,15 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, Response, g
 from datetime import datetime, timedelta, timezone
 from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import re
 import random
-import schedule
+import functools
+import hashlib
+import hmac
+import json
 import threading
+import atexit
 import time
+import queue
+import collections
 import sqlite3
+import csv
 
 """
 Smart Agriculture (Merged)
@@ -40,11 +51,18 @@ HOST       = os.getenv("FLASK_HOST", "0.0.0.0")
 PORT       = int(os.getenv("FLASK_PORT", "5000"))
 # ESP32
 # config.py (or near the top of your app)
-ESP32_ENDPOINT   = "http://10.64.119.95/data"   # <-- absolute, not a relative path
-ESP32_TIMEOUT_S  = 2.5
+ESP32_ENDPOINT   = os.getenv("ESP32_ENDPOINT", "http://10.64.119.95/data")   # <-- absolute, not a relative path
+ESP32_TIMEOUT_S  = float(os.getenv("ESP32_TIMEOUT_S", "3"))
+# Fields passed through by /api/esp32/data (missing ones are sent as null)
+ESP32_FIELDS = (
+    "soil_raw", "soil_pct", "ultrasonic_cm", "temp_c", "humidity_pct", "pump_on",
+    "auto_mode", "soil_threshold_raw", "ip", "uptime_s", "wifi_ssid",
+)
 TANK_H1_CM = 9.5
 TANK_R_CM  = 4.85
 PI_CONST   = 22/7
+# 1 mm of water over 1 acre (4046.86 m²) = 4046.86 L
+LITRES_PER_ACRE_MM = 4046.86
 
 
 # Weather config (env preferred; falls back to prior values)
@@ -57,6 +75,7 @@ TANK_ALERT_TIME_MORNING  = os.getenv("TANK_ALERT_TIME_MORNING", "06:00")
 TANK_ALERT_TIME_EVENING  = os.getenv("TANK_ALERT_TIME_EVENING", "18:00")
 
 SQLITE_PATH = os.getenv("SQLITE_PATH", "smart_agri.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
 
 # ---------- APP ----------
 app = Flask(__name__)
@@ -79,18 +98,220 @@ def _(text, **kwargs):
         return text
 
 # ---------- GLOBALS / DATA ----------
-FARMER_ALERTS: list[dict] = []
-CROPS_DF = pd.read_csv(os.path.join(BASE_DIR, "cropsnew.csv"), encoding="cp1252")
-CROPS_DF.columns = (CROPS_DF.columns.str.strip().str.replace("\u00a0", " ", regex=False))
-for col in ["Crop", "Soil Type", "Soil Moisture"]:
-    if col in CROPS_DF.columns:
-        CROPS_DF[col] = CROPS_DF[col].astype(str).str.strip()
+# In-memory alert feed, bounded so long uptimes don't grow it (oldest dropped first)
+MAX_FARMER_ALERTS = 500
+FARMER_ALERTS: "collections.deque[dict]" = collections.deque(maxlen=MAX_FARMER_ALERTS)
+# Serialized /api/alerts body, rebuilt on the first read after a new alert
+_ALERTS_JSON_CACHE: bytes | None = None
+_ALERTS_LOCK = threading.Lock()
+# Only the CSV columns the app reads (matched on the cleaned header name)
+CROP_COLUMNS = {
+    "Crop", "Total Water ( mm )", "Crop Duration (days)", "Daily Water (L/ha/day)",
+    "Soil Type", "Soil Moisture", "Min Temp", "Max temp", "Min Humidity", "Max Humidity",
+    "Pesticides", "fertilizers",
+    # yield / price header variants probed by crop_detail
+    "Yield(Kg)", "Yield (Kg)", "Yield", "Yield_per_acre",
+    "Price", "Prize(Summer)", "Prize", "Price (₹/kg)",
+}
+
+def _read_crops(path):
+    """(rows, fields) for cropsnew.csv: row dicts restricted to CROP_COLUMNS, headers and cells stripped."""
+    with open(path, encoding="cp1252", newline="") as f:
+        reader = csv.reader(f)
+        header = [h.strip().replace("\u00a0", " ") for h in next(reader)]
+        keep = [(i, h) for i, h in enumerate(header) if h in CROP_COLUMNS]
+        return [
+            {h: (r[i].strip() if i < len(r) else "") for i, h in keep}
+            for r in reader if any(c.strip() for c in r)
+        ], [h for _, h in keep]
+
+# 43 rows; the stdlib reader keeps pandas out of the worker process
+CROPS_ROWS, CROPS_FIELDS = _read_crops(os.path.join(BASE_DIR, "cropsnew.csv"))
+
+# Default crop dropdown for the water calculator
+ALL_CROPS = sorted({row["Crop"] for row in CROPS_ROWS if row.get("Crop")})
+
+@functools.lru_cache(maxsize=2048)
+def _crop_key(name: str) -> str:
+    """Normalized lookup key for a crop name (CSV value, URL segment or form field)."""
+    return name.strip().casefold()
+
+# Crop rows keyed by casefolded name for O(1) detail-page lookups (first row wins)
+CROPS_BY_KEY: dict[str, dict] = {}
+for _row in CROPS_ROWS:
+    CROPS_BY_KEY.setdefault(_crop_key(_row.get("Crop", "")), _row)
+
+# Yield (kg/acre) and price (₹/kg) header variants, narrowed to those in the CSV
+YIELD_COLS = [c for c in ['Yield(Kg)', 'Yield (Kg)', 'Yield', 'Yield_per_acre'] if c in CROPS_FIELDS]
+PRICE_COLS = [c for c in ['Price', 'Prize(Summer)', 'Prize', 'Price (₹/kg)'] if c in CROPS_FIELDS]
+
+def _first_float(row, cols):
+    """Value of the first column in `cols` that parses as a float; 0.0 if none does."""
+    for k in cols:
+        try:
+            return float(row.get(k) or 0)
+        except Exception:
+            pass
+    return 0.0
+
+YIELD_BY_KEY = {key: _first_float(row, YIELD_COLS) for key, row in CROPS_BY_KEY.items()}
+PRICE_BY_KEY = {key: _first_float(row, PRICE_COLS) for key, row in CROPS_BY_KEY.items()}
+
+# ---------- CROP RECOMMENDATION INDEX ----------
+# The dashboard filter inputs are parsed once here so a request only runs
+# vectorized comparisons instead of re-coercing the whole CSV.
+
+_RANGE_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*[-–]\s*(-?\d+(?:\.\d+)?)\s*$')
+_TOKEN_RE = re.compile(r'[/,;|\-]+')
+
+def _num(x):
+    """Coerce to float. Supports simple ranges like '20-30' by using the midpoint."""
+    if x is None:
+        return np.nan
+    s = str(x).strip()
+    if not s:
+        return np.nan
+    m = _RANGE_RE.match(s)
+    if m:
+        a = float(m.group(1)); b = float(m.group(2))
+        return (a + b) / 2.0
+    try:
+        return float(s)
+    except Exception:
+        return np.nan
+
+# Seasonal water need (mm) per crop; ranges like '400-500' use the midpoint,
+# anything unparseable counts as 0 instead of failing startup.
+WATER_MM_BY_KEY: dict[str, float] = {
+    key: float(np.nan_to_num(_num(row.get("Total Water ( mm )")))) for key, row in CROPS_BY_KEY.items()
+}
+
+def _norm(s):
+    return (str(s) if s is not None else "").strip().lower()
+
+def _tokenize_categories(cell):
+    """Split 'Low / Medium' or 'low,medium' or 'flooded' into ['low','medium'] etc."""
+    parts = _TOKEN_RE.split(str(cell) if cell is not None else "")
+    return [_norm(p) for p in parts if _norm(p)]
 
+def _moisture_bucket_from_pct(pct):
+    """Map live % to one of: low, medium, high, flooded, unknown."""
+    try:
+        v = float(pct)
+    except Exception:
+        return "unknown"
+    if v >= 90:
+        return "flooded"
+    elif v > 70:
+        return "high"
+    elif v >= 40:
+        return "medium"
+    else:
+        return "low"
+
+# Humidity columns sometimes have trailing spaces; handle both
+COL_MIN_HUM = next((c for c in ["Min Humidity", "Min Humidity "] if c in CROPS_FIELDS), None)
+COL_MAX_HUM = next((c for c in ["Max Humidity", "Max Humidity "] if c in CROPS_FIELDS), None)
+
+# Row dicts the dashboard filters on and renders, with numeric columns coerced
+# (also parses "20-30"); requests select from this list by mask index.
+_REC_NUM_COLS = [c for c in ["Min Temp", "Max temp", COL_MIN_HUM, COL_MAX_HUM, "Total Water ( mm )"]
+                 if c and c in CROPS_FIELDS]
+CROPS_REC_RECORDS = [{**row, **{c: _num(row[c]) for c in _REC_NUM_COLS}} for row in CROPS_ROWS]
+
+def _frozen(values, dtype=None):
+    """Read-only numpy view, so request handlers can share it without copying."""
+    arr = np.asarray(values, dtype=dtype)
+    arr.setflags(write=False)
+    return arr
+
+# Numeric filter columns as frozen float arrays (only those present in the CSV)
+CROPS_NUM = {
+    key: _frozen([row[col] for row in CROPS_REC_RECORDS], dtype=float)
+    for key, col in (("min_temp", "Min Temp"), ("max_temp", "Max temp"),
+                     ("min_hum", COL_MIN_HUM), ("max_hum", COL_MAX_HUM))
+    if col and col in CROPS_FIELDS
+}
+# Rows eligible at all: must have a crop name
+CROPS_BASE_MASK = _frozen([bool(row.get("Crop", True)) for row in CROPS_ROWS], dtype=bool)
+
+# Soil Moisture tokens per crop as frozensets, and from them one boolean
+# mask per live moisture bucket so the request does a single AND.
+MOISTURE_BUCKETS = ("low", "medium", "high", "flooded")
+if "Soil Moisture" in CROPS_FIELDS:
+    CROPS_SM_TOKENS = [frozenset(_tokenize_categories(row["Soil Moisture"])) for row in CROPS_ROWS]
+    CROPS_SM_MASK = {
+        bucket: _frozen([bucket in toks for toks in CROPS_SM_TOKENS], dtype=bool)
+        for bucket in MOISTURE_BUCKETS
+    }
+else:
+    CROPS_SM_TOKENS = None
+    CROPS_SM_MASK = None
+CROPS_SOIL_KEY = (_frozen([_norm(row["Soil Type"]) for row in CROPS_ROWS], dtype=object)
+                  if "Soil Type" in CROPS_FIELDS else None)
+
+TANK_CAPACITY_L = 5000  # simulated tank size for /api/tank_sensor_data
 CURRENT_TANK_LEVEL = 45  # simulated starting level
+_TANK_LOCK = threading.Lock()  # scheduler + request threads both update it
 
 # ---------- DB ----------
+# Idle connections shared by all request threads. Werkzeug starts a thread per
+# request, so a thread-local connection would never be reused; a LIFO keeps the
+# most recently used (warmest) connection at the front.
+_DB_POOL: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+
+def _connect():
+    """
+    Open a new connection with the per-connection pragmas.
+    journal_mode=WAL is persistent in the DB file and is set once in init_db().
+    """
+    # Long-lived connection + static SQL strings: keep every statement prepared
+    conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False, cached_statements=128)
+    conn.row_factory = sqlite3.Row  # name access + dict(row); index access still works
+    conn.executescript(
+        """PRAGMA synchronous=NORMAL;
+           PRAGMA cache_size=-64000;
+           PRAGMA temp_store=MEMORY;
+           PRAGMA busy_timeout=5000;
+           PRAGMA mmap_size=268435456;"""
+    )
+    return conn
+
+
+def get_conn():
+    """
+    Return the current request's SQLite connection, checking one out of the pool
+    on first use. It goes back to the pool at teardown, so callers must not close
+    it; use `with conn:` for transactions.
+    """
+    conn = g.get("db_conn")
+    if conn is None:
+        try:
+            conn = _DB_POOL.get_nowait()
+        except queue.Empty:
+            conn = _connect()
+        g.db_conn = conn
+    return conn
+
+
+@app.teardown_appcontext
+def release_conn(exc):
+    conn = g.pop("db_conn", None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _DB_POOL.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
 def init_db():
-    conn = sqlite3.connect(SQLITE_PATH)
+    conn = _connect()
+    # WAL so the scheduler's writes don't block request-thread reads
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     cursor.execute(
         """CREATE TABLE IF NOT EXISTS users (
@@ -114,6 +335,10 @@ def init_db():
             FOREIGN KEY (userid) REFERENCES users (userid)
         )"""
     )
+    # /api/user_crops: WHERE userid = ? ORDER BY created_at DESC
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_user_crops_user_created ON user_crops (userid, created_at DESC)"
+    )
     # NOTE: no sms_sent column (SMS removed)
     cursor.execute(
         """CREATE TABLE IF NOT EXISTS alert_history (
@@ -132,75 +357,292 @@ def init_db():
     conn.close()
 
 
-def save_alert_to_db(alert_data: dict, userid: str | None = None):
-    conn = sqlite3.connect(SQLITE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        """INSERT INTO alert_history 
-           (userid, alert_type, title, message, severity, category, created_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (
-            userid,
-            alert_data.get("type", "unknown"),
-            alert_data["title"],
-            alert_data["message"],
-            alert_data["severity"],
-            alert_data["category"],
-            alert_data["timestamp"],
-        ),
+# Each queue item is one save_alerts_to_db() group of rows, committed together.
+# A single writer thread drains the groups in batches, so a burst of alerts
+# costs one transaction instead of one commit each.
+ALERT_BATCH_WINDOW_S = 0.2
+ALERT_FLUSH_TIMEOUT_S = 10
+_ALERT_Q: "queue.Queue[list[tuple]]" = queue.Queue(maxsize=1000)
+_ALERT_INSERT_SQL = """INSERT INTO alert_history 
+    (userid, alert_type, title, message, severity, category, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+def _alert_row(alert_data: dict, userid: str | None) -> tuple:
+    return (
+        userid,
+        alert_data.get("type", "unknown"),
+        alert_data["title"],
+        alert_data["message"],
+        alert_data["severity"],
+        alert_data["category"],
+        alert_data["timestamp"],
     )
-    conn.commit()
-    conn.close()
+
+
+def save_alert_to_db(alert_data: dict, userid: str | None = None):
+    save_alerts_to_db([alert_data], userid=userid)
+
+
+def save_alerts_to_db(alerts: list[dict], userid: str | None = None):
+    """Queue several alerts as one item so they are committed in the same transaction."""
+    _ALERT_Q.put([_alert_row(a, userid) for a in alerts])
+
+
+def _write_alert_rows(conn, rows: list[tuple], deadline: float | None = None):
+    """
+    Insert `rows` in one transaction. OperationalError (e.g. 'database is locked'
+    past busy_timeout) keeps the rows and retries with backoff until `deadline`.
+    """
+    delay = 0.1
+    while True:
+        try:
+            with conn:
+                conn.executemany(_ALERT_INSERT_SQL, rows)
+            return
+        except sqlite3.OperationalError as e:
+            if deadline is not None and time.monotonic() + delay > deadline:
+                print(f"Alert writer gave up on {len(rows)} rows:", e)
+                return
+            print("Alert writer error, retrying:", e)
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+        except Exception as e:
+            print("Alert writer error:", e)
+            return
+
+
+def _drain_alert_groups(groups: list):
+    while True:
+        try:
+            groups.append(_ALERT_Q.get_nowait())
+        except queue.Empty:
+            return groups
+
+
+def _alert_writer():
+    conn = _connect()  # dedicated: the writer runs for the life of the process
+    while True:
+        groups = [_ALERT_Q.get()]
+        time.sleep(ALERT_BATCH_WINDOW_S)
+        _drain_alert_groups(groups)
+        try:
+            _write_alert_rows(conn, [row for grp in groups for row in grp])
+        finally:
+            for _ in groups:
+                _ALERT_Q.task_done()
+
+
+@atexit.register
+def flush_alerts():
+    """
+    The writer is a daemon thread, so anything still queued at exit (reloader
+    restart, shutdown right after the boot alerts) is written here synchronously,
+    then we wait for the writer's in-hand batch, both bounded by ALERT_FLUSH_TIMEOUT_S.
+    """
+    deadline = time.monotonic() + ALERT_FLUSH_TIMEOUT_S
+    groups = _drain_alert_groups([])
+    if groups:
+        conn = _connect()
+        try:
+            _write_alert_rows(conn, [row for grp in groups for row in grp], deadline)
+        finally:
+            conn.close()
+            for _ in groups:
+                _ALERT_Q.task_done()
+    with _ALERT_Q.all_tasks_done:
+        _ALERT_Q.all_tasks_done.wait_for(
+            lambda: not _ALERT_Q.unfinished_tasks, max(0.0, deadline - time.monotonic())
+        )
+
+
+def start_alert_writer():
+    t = threading.Thread(target=_alert_writer, daemon=True)
+    t.start()
 
 
 init_db()
+start_alert_writer()
 
 # ---------- HELPERS ----------
 
+# Shared pool for running independent OWM/ESP32 fetches concurrently
+FETCH_POOL = ThreadPoolExecutor(max_workers=3, thread_name_prefix="fetch")
+
+# One keep-alive session for OWM + ESP32 so calls reuse pooled connections
+HTTP = requests.Session()
+HTTP.headers["Connection"] = "keep-alive"
+# Retry a failed connect once; never re-send after a read timeout (that would
+# multiply the 8 s OWM timeout).
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                            max_retries=Retry(total=1, read=0, backoff_factor=0.2))
+HTTP.mount("http://", _HTTP_ADAPTER)
+HTTP.mount("https://", _HTTP_ADAPTER)
+# Dedicated pool for the LAN ESP32 so dashboard pollers don't contend with OWM calls.
+# No retries: an offline sensor should cost one ESP32_TIMEOUT_S, not three.
+HTTP.mount(ESP32_ENDPOINT, HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+
 def now_utc_iso():
     return datetime.now(timezone.utc).isoformat()
 
 
+def litres(acres, mm):
+    """Water volume in litres for `acres` at `mm` depth (1 mm = 1 L/m²)."""
+    return acres * mm * LITRES_PER_ACRE_MM if acres and mm else 0.0
+
+
+def revenue_of(acres, yield_kg_per_acre, price):
+    return (acres or 0.0) * yield_kg_per_acre * price
+
+
+# scrypt cost parameters for stored passwords
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+
+def _scrypt(password: str, salt: bytes) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+
+def hash_password(password: str) -> str:
+    """Return 'scrypt$<salt hex>$<digest hex>' for storage in users.password."""
+    salt = os.urandom(16)
+    return f"scrypt${salt.hex()}${_scrypt(password, salt).hex()}"
+
+def verify_password(stored: str, password: str) -> bool:
+    """Constant-time check; rows created before hashing hold the plain password until the next login."""
+    if stored.startswith("scrypt$"):
+        _, salt_hex, digest_hex = stored.split("$", 2)
+        return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt_hex)).hex(), digest_hex)
+    return hmac.compare_digest(stored.encode(), password.encode())
+
+
+class _Flight:
+    """One in-progress (or finished) call shared by every caller that asked for it."""
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def ttl_cache(ttl, cache_errors=False):
+    """
+    Cache a function's result per-args for `ttl` seconds.
+    The lock only guards the cache; `fn` runs outside it. Concurrent callers
+    for the same args wait on the single in-flight call and share its result.
+    Exceptions reach every waiter; with `cache_errors` they are also cached
+    and re-raised for `ttl`, so an offline upstream fails fast.
+    """
+    def decorator(fn):
+        cache = {}     # args -> (expiry, _Flight)
+        inflight = {}  # args -> _Flight
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            with lock:
+                hit = cache.get(args)
+                if hit and hit[0] > time.monotonic():
+                    return hit[1].result()
+                flight = inflight.get(args)
+                leader = flight is None
+                if leader:
+                    flight = inflight[args] = _Flight()
+            if not leader:
+                return flight.result()
+
+            try:
+                flight.value = fn(*args)
+            except BaseException as e:
+                flight.error = e
+            finally:
+                # Always release the waiters, even on KeyboardInterrupt/SystemExit;
+                # only ordinary exceptions are eligible for caching.
+                with lock:
+                    del inflight[args]
+                    if flight.error is None or (cache_errors and isinstance(flight.error, Exception)):
+                        cache[args] = (time.monotonic() + ttl, flight)
+                flight.done.set()
+            return flight.result()
+        return wrapper
+    return decorator
+
+
+@ttl_cache(ttl=600)
+def _fetch_weather():
+    """Current OWM weather; raises on failure so errors are never cached."""
+    url = f"http://api.openweathermap.org/data/2.5/weather?q={CITY}&appid={OWM_API_KEY}&units=metric"
+    resp = HTTP.get(url, timeout=8)
+    resp.raise_for_status()
+    w = resp.json()
+    return {
+        "temperature": round(w["main"]["temp"]),
+        "humidity": round(w["main"]["humidity"]),
+        "rainfall": round(w.get("rain", {}).get("1h", 0) or 0, 1),
+        "wind_speed": round(w["wind"]["speed"]),
+    }
+
 def get_weather_data():
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={CITY}&appid={OWM_API_KEY}&units=metric"
-        resp = requests.get(url, timeout=8)
-        resp.raise_for_status()
-        w = resp.json()
-        return {
-            "temperature": round(w["main"]["temp"]),
-            "humidity": round(w["main"]["humidity"]),
-            "rainfall": round(w.get("rain", {}).get("1h", 0) or 0, 1),
-            "wind_speed": round(w["wind"]["speed"]),
-        }
+        return _fetch_weather()
     except Exception as e:
         print("Weather API error:", e)
         return {"temperature": 22, "humidity": 70, "rainfall": 0, "wind_speed": 5}
 
 
+def _forecast_columns(times, rains, descriptions, humidities):
+    return {
+        "times": times,
+        "rains": np.asarray(rains, dtype=np.float64),
+        "descriptions": descriptions,
+        "humidities": np.asarray(humidities, dtype=np.float64),
+    }
+
+@ttl_cache(ttl=600)
+def _fetch_forecast():
+    """Today's OWM forecast columns; raises on failure so errors are never cached."""
+    url = f"http://api.openweathermap.org/data/2.5/forecast?q={CITY}&appid={OWM_API_KEY}&units=metric"
+    resp = HTTP.get(url, timeout=8)
+    resp.raise_for_status()
+    forecast = resp.json()
+    today = datetime.now().date()
+    times, rains, descriptions, humidities = [], [], [], []
+    for item in forecast["list"]:
+        dt = datetime.fromtimestamp(item["dt"])
+        if dt.date() == today:
+            times.append(dt.strftime("%H:%M"))
+            rains.append(item.get("rain", {}).get("3h", 0) or 0)
+            descriptions.append(item["weather"][0]["description"])
+            humidities.append(item["main"]["humidity"])
+    return _forecast_columns(times, rains, descriptions, humidities)
+
 def get_weather_forecast():
+    """
+    Today's 3-hourly forecast as parallel columns:
+      { times: [str], rains: ndarray, descriptions: [str], humidities: ndarray }
+    Columns are empty if the API is unreachable.
+    """
     try:
-        url = f"http://api.openweathermap.org/data/2.5/forecast?q={CITY}&appid={OWM_API_KEY}&units=metric"
-        resp = requests.get(url, timeout=8)
-        resp.raise_for_status()
-        forecast = resp.json()
-        today = datetime.now().date()
-        today_forecast = []
-        for item in forecast["list"]:
-            dt = datetime.fromtimestamp(item["dt"])
-            if dt.date() == today:
-                today_forecast.append(
-                    {
-                        "time": dt.strftime("%H:%M"),
-                        "rain": item.get("rain", {}).get("3h", 0) or 0,
-                        "description": item["weather"][0]["description"],
-                        "humidity": item["main"]["humidity"],
-                    }
-                )
-        return today_forecast
+        return _fetch_forecast()
     except Exception as e:
         print("Weather forecast API error:", e)
-        return []
+        return _forecast_columns([], [], [], [])
+
+@ttl_cache(ttl=2, cache_errors=True)
+def _fetch_esp32():
+    """
+    Single GET of ESP32 /data shared by the soil and tank readers.
+    Raises on failure; the failure is cached too, so pollers of an offline
+    sensor get the error immediately instead of each waiting out the timeout.
+    """
+    r = HTTP.get(ESP32_ENDPOINT, timeout=ESP32_TIMEOUT_S)
+    r.raise_for_status()
+    return r.json()
 
 def get_soil_data():
     """
@@ -208,9 +650,7 @@ def get_soil_data():
     Returns dict or None if sensor unreachable.
     """
     try:
-        r = requests.get(ESP32_ENDPOINT, timeout=ESP32_TIMEOUT_S)
-        r.raise_for_status()
-        j = r.json()
+        j = _fetch_esp32()
         return {
             "moisture": float(j.get("soil_pct", 0) or 0),
             "temperature": float(j.get("temp_c", 0) or 0),
@@ -220,8 +660,11 @@ def get_soil_data():
         print("ESP32 read failed in get_soil_data():", e)
         return None   # <-- important
 
+# Static irrigation card data; shared read-only (no caller mutates it)
+_IRRIGATION_DATA = {"schedule": "Active", "next_watering": "14:30", "duration": 25, "pressure": 2.8}
+
 def get_irrigation_data():
-    return {"schedule": "Active", "next_watering": "14:30", "duration": 25, "pressure": 2.8}
+    return _IRRIGATION_DATA
 
 # Tank geometry (set real values!)
 TANK_RADIUS_CM   = float(os.getenv("TANK_RADIUS_CM", "4.85"))   # cylinder radius
@@ -234,9 +677,7 @@ def get_tank_snapshot():
       { ultrasonic_cm, height_cm, volume_cm3, capacity_cm3, percent }
     Raises on failure.
     """
-    r = requests.get(ESP32_ENDPOINT, timeout=ESP32_TIMEOUT_S)
-    r.raise_for_status()
-    j = r.json()
+    j = _fetch_esp32()
     u = float(j.get("ultrasonic_cm"))
 
     H1 = TANK_H1_CM
@@ -260,8 +701,10 @@ def get_tank_snapshot():
 def get_tank_level():
     global CURRENT_TANK_LEVEL
     change = random.uniform(-2, 2)
-    CURRENT_TANK_LEVEL = max(0, min(100, CURRENT_TANK_LEVEL + change))
-    sensor = max(0, min(100, CURRENT_TANK_LEVEL + random.uniform(-1, 1)))
+    with _TANK_LOCK:
+        CURRENT_TANK_LEVEL = max(0, min(100, CURRENT_TANK_LEVEL + change))
+        level = CURRENT_TANK_LEVEL
+    sensor = max(0, min(100, level + random.uniform(-1, 1)))
     return round(sensor, 1)
 
 
@@ -269,31 +712,61 @@ def simulate_sensor_scenarios():
     global CURRENT_TANK_LEVEL
     scenario = random.choice(["normal", "irrigation_use", "refill", "leak", "stable"])
     if scenario == "irrigation_use":
-        CURRENT_TANK_LEVEL -= random.uniform(0.5, 2.0)
+        delta = -random.uniform(0.5, 2.0)
     elif scenario == "refill":
-        CURRENT_TANK_LEVEL += random.uniform(1.0, 3.0)
+        delta = random.uniform(1.0, 3.0)
     elif scenario == "leak":
-        CURRENT_TANK_LEVEL -= random.uniform(0.1, 0.5)
+        delta = -random.uniform(0.1, 0.5)
     elif scenario == "stable":
-        CURRENT_TANK_LEVEL += random.uniform(-0.2, 0.2)
-    CURRENT_TANK_LEVEL = max(0, min(100, CURRENT_TANK_LEVEL))
+        delta = random.uniform(-0.2, 0.2)
+    else:
+        delta = 0
+    with _TANK_LOCK:
+        CURRENT_TANK_LEVEL = max(0, min(100, CURRENT_TANK_LEVEL + delta))
 
 
 # ---------- ALERT LOGIC ----------
 
+# Checks are shared by the scheduler and several manual endpoints. Only their
+# reads are memoized (OWM for 600 s, ESP32 for 2 s); each call still builds a
+# fresh alert, so repeated runs never re-add the same dict to the feed.
+
 def add_alert(alert: dict, save_for_user: str | None = None):
     if not alert:
         return
-    FARMER_ALERTS.append(alert)
-    save_alert_to_db(alert, userid=save_for_user)
+    add_alerts([alert], save_for_user=save_for_user)
+
+def add_alerts(alerts: list[dict], save_for_user: str | None = None):
+    global _ALERTS_JSON_CACHE
+    alerts = [a for a in alerts if a]
+    if not alerts:
+        return
+    with _ALERTS_LOCK:
+        FARMER_ALERTS.extend(alerts)
+        _ALERTS_JSON_CACHE = None
+    save_alerts_to_db(alerts, userid=save_for_user)
+
+def alerts_json() -> bytes:
+    """JSON body for /api/alerts, serialized once per change instead of per request."""
+    global _ALERTS_JSON_CACHE
+    with _ALERTS_LOCK:
+        if _ALERTS_JSON_CACHE is None:
+            _ALERTS_JSON_CACHE = json.dumps({'alerts': list(FARMER_ALERTS)}).encode()
+        return _ALERTS_JSON_CACHE
+
+def alerts_snapshot() -> list[dict]:
+    """Copy of the alert feed; a deque can't be iterated while the scheduler appends."""
+    with _ALERTS_LOCK:
+        return list(FARMER_ALERTS)
 
 def check_rain_alert():
-    forecast = get_weather_forecast()
-    if not forecast:
+    ts = now_utc_iso()
+    rains = get_weather_forecast()["rains"]
+    if not rains.size:
         return None
 
-    total_rain = sum(item["rain"] for item in forecast)
-    max_rain = max((item["rain"] for item in forecast), default=0)
+    total_rain = float(rains.sum())
+    max_rain = float(rains.max(initial=0.0))
 
     current_weather = get_weather_data()
     soil = get_soil_data()
@@ -303,7 +776,6 @@ def check_rain_alert():
     h = current_weather.get("humidity", 70)
     r = current_weather.get("rainfall", 0)
     w = current_weather.get("wind_speed", 5)
-    ts = now_utc_iso()
 
     if total_rain > 5.0 or max_rain > 2.0:
         return {
@@ -371,17 +843,12 @@ def check_rain_alert():
                 "icon": "🌤",
             }
 
-# at top of your module (if not already present)
-import os, requests
-
-ESP32_ENDPOINT    = os.getenv("ESP32_ENDPOINT", "http://10.64.119.95/data")
-ESP32_TIMEOUT_S   = float(os.getenv("ESP32_TIMEOUT_S", "3"))
-
 def check_water_tank_alert():
     """
     Build alert from LIVE ultrasonic reading using the same geometry/rounding
     as the tank card.
     """
+    ts = now_utc_iso()
     try:
         snap = get_tank_snapshot()
     except Exception as e:
@@ -391,7 +858,6 @@ def check_water_tank_alert():
     p = snap["percent"]
     a_cm3 = snap["volume_cm3"]
     c_cm3 = snap["capacity_cm3"]
-    ts = now_utc_iso()
 
     # If you prefer liters in alerts, convert here (uncomment these 2 lines
     # and switch the msg line below).
@@ -437,18 +903,21 @@ def check_water_tank_alert():
 
 
 def check_weather_irrigation_recommendation():
+    ts = now_utc_iso()
     try:
-        weather = get_weather_data()
-        soil = get_soil_data()
-        forecast = get_weather_forecast()
-        total_rain = sum((i["rain"] for i in forecast), 0) if forecast else 0
-        max_rain = max((i["rain"] for i in forecast), default=0)
+        # Independent endpoints: total latency is the slowest call, not the sum
+        fw = FETCH_POOL.submit(get_weather_data)
+        fs = FETCH_POOL.submit(get_soil_data)
+        ff = FETCH_POOL.submit(get_weather_forecast)
+        weather, soil = fw.result(), fs.result()
+        rains = ff.result()["rains"]
+        total_rain = float(rains.sum())
+        max_rain = float(rains.max(initial=0.0))
         t, h = weather["temperature"], weather["humidity"]
         curr_rain, wind = weather["rainfall"], weather["wind_speed"]
         sm = (soil or {}).get("moisture")
         st = (soil or {}).get("temperature")
         sh = (soil or {}).get("humidity")
-        ts = now_utc_iso()
 
         # Heavy/medium rain branches don't need soil
         if total_rain > 5.0 or max_rain > 2.0 or curr_rain > 1.0:
@@ -523,7 +992,7 @@ def check_weather_irrigation_recommendation():
             "message": _("Unable to fetch weather data."),
             "severity": "medium",
             "category": "irrigation",
-            "timestamp": now_utc_iso(),
+            "timestamp": ts,
             "recommendation": _("Check conditions manually."),
             "icon": "⚠️",
         }
@@ -572,23 +1041,63 @@ def generate_water_tank_alert():
     }
     add_alert(upd)
 
+def next_occurrence(hhmm: str) -> datetime:
+    """Next local datetime (strictly after now) at HH:MM."""
+    now = datetime.now()
+    hour, minute = (int(p) for p in hhmm.split(":"))
+    next_dt = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_dt <= now:
+        next_dt += timedelta(days=1)
+    return next_dt
+
+def schedule_daily(hhmm: str, job, target: datetime = None):
+    """Run `job` at HH:MM every day; sleeps until the fire time instead of polling.
+
+    Each run re-arms for its own `target` + 1 day, so a Timer that wakes slightly
+    early can't fire the job twice; if that is already past (suspend, clock jump)
+    it skips to the next occurrence instead of replaying every missed day.
+    """
+    if target is None:
+        target = next_occurrence(hhmm)
+
+    def run_and_reschedule():
+        try:
+            job()
+        except Exception as e:
+            print(f"Scheduled job {job.__name__} failed:", e)
+        schedule_daily(hhmm, job, max(target + timedelta(days=1), next_occurrence(hhmm)))
+
+    delay = max(0.0, (target - datetime.now()).total_seconds())
+    t = threading.Timer(delay, run_and_reschedule)
+    t.daemon = True
+    t.start()
+
 def schedule_daily_alerts():
-    schedule.every().day.at(DAILY_WEATHER_ALERT_TIME).do(generate_daily_weather_alert)
-    schedule.every().day.at(TANK_ALERT_TIME_MORNING).do(generate_water_tank_alert)
-    schedule.every().day.at(TANK_ALERT_TIME_EVENING).do(generate_water_tank_alert)
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+    schedule_daily(DAILY_WEATHER_ALERT_TIME, generate_daily_weather_alert)
+    schedule_daily(TANK_ALERT_TIME_MORNING, generate_water_tank_alert)
+    schedule_daily(TANK_ALERT_TIME_EVENING, generate_water_tank_alert)
 
 
 def start_alert_scheduler():
-    t = threading.Thread(target=schedule_daily_alerts, daemon=True)
-    t.start()
+    schedule_daily_alerts()
     print("Alert scheduler started.")
 
 
 # ---------- ROUTES ----------
 
+# Body of the 401 returned by every /api route; a fresh Response is built per
+# call because Flask attaches per-request headers (e.g. session cookie) to it.
+_UNAUTHORIZED_BODY = json.dumps({'error': 'Unauthorized'}).encode()
+
+def api_login_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if 'username' not in session:
+            return Response(_UNAUTHORIZED_BODY, status=401, mimetype='application/json')
+        return view(*args, **kwargs)
+    return wrapper
+
+
 @app.route("/")
 def home():
     if "username" in session:
@@ -615,20 +1124,17 @@ def register():
             flash(_("Name and Password cannot be empty."), "error")
             return redirect(url_for("register"))
 
-        conn = sqlite3.connect(SQLITE_PATH)
-        cursor = conn.cursor()
+        conn = get_conn()
         try:
-            cursor.execute(
-                "INSERT INTO users (userid, name, password, phone) VALUES (?, ?, ?, ?)",
-                (userid, name, password, phone),
-            )
-            conn.commit()
+            with conn:
+                conn.execute(
+                    "INSERT INTO users (userid, name, password, phone) VALUES (?, ?, ?, ?)",
+                    (userid, name, hash_password(password), phone),
+                )
             flash(_("Registration successful! Please login."), "success")
             return redirect(url_for("login"))
         except sqlite3.IntegrityError:
             flash(_("UserID already exists. Try another one."), "error")
-        finally:
-            conn.close()
     return render_template("register.html")
 
 
@@ -638,16 +1144,18 @@ def login():
         userid = request.form["userid"]
         password = request.form["password"]
 
-        conn = sqlite3.connect(SQLITE_PATH)
+        conn = get_conn()
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE userid=? AND password=?", (userid, password))
+        cursor.execute("SELECT userid, name, password, phone FROM users WHERE userid=?", (userid,))
         user = cursor.fetchone()
-        conn.close()
 
-        if user:
+        if user and verify_password(user[2], password):
+            if not user[2].startswith("scrypt$"):
+                # Legacy plaintext row: upgrade it now that we have the password
+                with conn:
+                    conn.execute("UPDATE users SET password=? WHERE userid=?", (hash_password(password), user[0]))
             session["userid"] = user[0]
             session["username"] = user[1]
-            session["password"] = user[2]
             session["phone"] = user[3]
             flash(_("Login successful!"), "success")
             return redirect(url_for("dashboard"))
@@ -662,6 +1170,18 @@ def logout():
     flash(_("You have been logged out."), "success")
     return redirect(url_for("login"))
 
+def _dashboard_data(soil, weather, crops, soil_category):
+    """Template context for dashboard.html (both the live and no-sensor paths)."""
+    return {
+        'soil': soil,
+        'weather': weather,
+        'irrigation': get_irrigation_data(),
+        'tank_level': get_tank_level(),
+        'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'crops': crops,
+        'soil_category': soil_category
+    }
+
 @app.route('/dashboard', methods=['GET', 'POST'])
 def dashboard():
     if "username" not in session:
@@ -680,118 +1200,41 @@ def dashboard():
         recommended = []
         moisture_category = "Unknown"
         session['recommended_crops'] = []
-        data = {
-            'soil': None,
-            'weather': weather,
-            'irrigation': get_irrigation_data(),
-            'tank_level': get_tank_level(),
-            'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'crops': recommended,
-            'soil_category': moisture_category
-        }
+        data = _dashboard_data(None, weather, recommended, moisture_category)
         flash(_("No live soil sensor data. Connect ESP32 to see crop recommendations."), "warning")
         return render_template('dashboard.html', username=session["username"], data=data, selected_soil=selected_soil)
 
-    # ========== Robust recommendation logic (self-contained) ==========
-    import re
-    import numpy as np
-    import pandas as pd
-
-    def _num(x):
-        """Coerce to float. Supports simple ranges like '20-30' by using the midpoint."""
-        if x is None:
-            return np.nan
-        s = str(x).strip()
-        if not s:
-            return np.nan
-        m = re.match(r'^\s*(-?\d+(?:\.\d+)?)\s*[-–]\s*(-?\d+(?:\.\d+)?)\s*$', s)
-        if m:
-            a = float(m.group(1)); b = float(m.group(2))
-            return (a + b) / 2.0
-        try:
-            return float(s)
-        except Exception:
-            return np.nan
-
-    def _norm(s):
-        return (str(s) if s is not None else "").strip().lower()
-
-    def _tokenize_categories(cell):
-        """Split 'Low / Medium' or 'low,medium' or 'flooded' into ['low','medium'] etc."""
-        parts = re.split(r'[/,;|\-]+', str(cell) if cell is not None else "")
-        return [_norm(p) for p in parts if _norm(p)]
-
-    def _moisture_bucket_from_pct(pct):
-        """Map live % to one of: low, medium, high, flooded, unknown."""
-        try:
-            v = float(pct)
-        except Exception:
-            return "unknown"
-        if v >= 90:
-            return "flooded"
-        elif v > 70:
-            return "high"
-        elif v >= 40:
-            return "medium"
-        else:
-            return "low"
-
     # Compute live moisture category for display
     live_bucket = _moisture_bucket_from_pct(soil.get("moisture"))
     moisture_category = "Unknown" if live_bucket == "unknown" else live_bucket.capitalize()
 
     try:
-        df = CROPS_DF.copy()
-
-        # Columns in your CSV (from the sample you shared)
-        # Sl.no, Crop, Minimum Practical Area (acre), Total Water ( mm ), ..., Soil Type, Soil Moisture,
-        # Min Temp, Max temp, ..., Min Humidity , Max Humidity , ...
-
-        # Humidity columns sometimes have trailing spaces; handle both
-        hum_min_cols = ["Min Humidity", "Min Humidity "]
-        hum_max_cols = ["Max Humidity", "Max Humidity "]
-
-        # Pick the first existing humidity column variant
-        col_min_hum = next((c for c in hum_min_cols if c in df.columns), None)
-        col_max_hum = next((c for c in hum_max_cols if c in df.columns), None)
-
-        # Safely coerce numeric columns (also parses "20-30")
-        for col in ["Min Temp", "Max temp", col_min_hum, col_max_hum, "Total Water ( mm )"]:
-            if col and col in df.columns:
-                df[col] = df[col].map(_num)
-
-        # Start with allow-all mask, then constrain only when that column exists
-        mask = pd.Series(True, index=df.index)
+        # Start from the precomputed base mask, then constrain only when that column exists
+        mask = CROPS_BASE_MASK.copy()
 
         # Temperature range
-        if "Min Temp" in df.columns:
-            mask &= (df["Min Temp"] <= _num(soil.get("temperature")))
-        if "Max temp" in df.columns:
-            mask &= (df["Max temp"] >= _num(soil.get("temperature")))
+        live_t = _num(soil.get("temperature"))
+        if "min_temp" in CROPS_NUM:
+            mask &= (CROPS_NUM["min_temp"] <= live_t)
+        if "max_temp" in CROPS_NUM:
+            mask &= (CROPS_NUM["max_temp"] >= live_t)
 
         # Humidity range
         live_h = _num(soil.get("humidity"))
-        if col_min_hum:
-            mask &= (df[col_min_hum] <= live_h)
-        if col_max_hum:
-            mask &= (df[col_max_hum] >= live_h)
+        if "min_hum" in CROPS_NUM:
+            mask &= (CROPS_NUM["min_hum"] <= live_h)
+        if "max_hum" in CROPS_NUM:
+            mask &= (CROPS_NUM["max_hum"] >= live_h)
 
         # Soil Moisture category (text) — only apply if the column exists and we know the bucket
-        if "Soil Moisture" in df.columns and live_bucket != "unknown":
-            sm_tokens = df["Soil Moisture"].apply(_tokenize_categories)
-            want = live_bucket  # 'low'|'medium'|'high'|'flooded'
-            mask &= sm_tokens.apply(lambda toks: any(t == want for t in toks))
+        if CROPS_SM_MASK is not None and live_bucket != "unknown":
+            mask &= CROPS_SM_MASK[live_bucket]
 
         # Soil Type filter from the UI dropdown (optional)
-        if selected_soil and "Soil Type" in df.columns:
-            want_st = _norm(selected_soil)
-            mask &= (df["Soil Type"].astype(str).str.strip().str.lower() == want_st)
-
-        # Keep only rows with a crop name
-        if "Crop" in df.columns:
-            mask &= df["Crop"].notna()
+        if selected_soil and CROPS_SOIL_KEY is not None:
+            mask &= (CROPS_SOIL_KEY == _norm(selected_soil))
 
-        recommended = df.loc[mask].to_dict(orient="records")
+        recommended = [CROPS_REC_RECORDS[i] for i in np.flatnonzero(mask)]
     except Exception as e:
         print("Crop filter error:", e)
         recommended = []
@@ -800,39 +1243,29 @@ def dashboard():
 
     session['recommended_crops'] = [c.get("Crop") for c in recommended if c.get("Crop")]
 
-    data = {
-        'soil': soil,
-        'weather': weather,
-        'irrigation': get_irrigation_data(),
-        'tank_level': get_tank_level(),
-        'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'crops': recommended,
-        'soil_category': moisture_category
-    }
+    data = _dashboard_data(soil, weather, recommended, moisture_category)
     return render_template('dashboard.html', username=session["username"], data=data, selected_soil=selected_soil)
 
 @app.route("/dashboard2")
 def dashboard2():
     username = session.get("username", "Guest")
-    conn = sqlite3.connect(SQLITE_PATH)
+    conn = get_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT userid, name, phone FROM users")
     users = cursor.fetchall()
-    conn.close()
     return render_template("dashboard2.html", username=username, users=users)
 
 
 @app.route('/water_calc', methods=['GET', 'POST'])
 def water_calc():
-    crop_options = session.get('recommended_crops', sorted(CROPS_DF["Crop"].dropna().unique().tolist()))
+    crop_options = session.get('recommended_crops', ALL_CROPS)
     selected_crop, result, water_mm = None, None, None
     if request.method == 'POST':
         selected_crop = request.form['crop']
         acres = float(request.form['acres'])
-        row = CROPS_DF.loc[CROPS_DF["Crop"] == selected_crop]
-        if not row.empty:
-            water_mm = float(row.iloc[0]["Total Water ( mm )"])
-            result = acres * 4046.86 * water_mm  # L = mm * m² ; 1 acre = 4046.86 m²
+        water_mm = WATER_MM_BY_KEY.get(_crop_key(selected_crop))
+        if water_mm is not None:
+            result = litres(acres, water_mm)
     return render_template("water.html", crop_options=crop_options, selected_crop=selected_crop, water_mm=water_mm, result=result)
 
 
@@ -840,68 +1273,42 @@ def water_calc():
 def alerts():
     if 'username' not in session:
         return redirect(url_for('login'))
-    return render_template('alerts.html', alerts=FARMER_ALERTS)
+    return render_template('alerts.html', alerts=alerts_snapshot())
 
 
 # --- Crop detail page (merged from first app) ---
 @app.route('/crop/<path:crop_name>', methods=['GET', 'POST'])
 def crop_detail(crop_name):
-    name = unquote(crop_name).strip()
-    row = CROPS_DF.loc[CROPS_DF['Crop'].str.strip().str.casefold() == name.casefold()]
-    if row.empty:
+    key = _crop_key(unquote(crop_name))
+    crop = CROPS_BY_KEY.get(key)
+    if crop is None:
         abort(404)
-    crop = row.iloc[0].to_dict()
 
-    water_mm = float(crop.get('Total Water ( mm )', 0) or 0)
+    water_mm = WATER_MM_BY_KEY[key]
 
-    # Yield (kg/acre)
-    yield_kg_per_acre = None
-    for k in ['Yield(Kg)', 'Yield (Kg)', 'Yield', 'Yield_per_acre']:
-        if k in crop:
-            try:
-                yield_kg_per_acre = float(crop.get(k) or 0)
-                break
-            except Exception:
-                pass
-    if yield_kg_per_acre is None:
-        yield_kg_per_acre = 0.0
-
-    # Price (₹/kg)
-    price = None
-    for k in ['Price', 'Prize(Summer)', 'Prize', 'Price (₹/kg)']:
-        if k in crop:
-            try:
-                price = float(crop.get(k) or 0)
-                break
-            except Exception:
-                pass
-    if price is None:
-        price = 0.0
+    yield_kg_per_acre = YIELD_BY_KEY[key]
+    price = PRICE_BY_KEY[key]
 
+    # Only parse and compute the form that was actually submitted
     which = request.form.get("which")  # "profit" or None
-    acres = request.form.get("acres", type=float)
-    total_litres = None
-    water_mm_display = None
-
-    acres_profit = request.form.get("acres_profit", type=float)
-    other_expenses = request.form.get("other_expenses", type=float)
-    revenue = profit = None
+    acres = total_litres = water_mm_display = None
+    acres_profit = other_expenses = revenue = profit = None
 
     if which == "profit":
+        acres_profit = request.form.get("acres_profit", type=float)
+        other_expenses = request.form.get("other_expenses", type=float)
         if acres_profit and acres_profit > 0:
             other_expenses = other_expenses or 0.0
-            revenue = acres_profit * yield_kg_per_acre * price
+            revenue = revenue_of(acres_profit, yield_kg_per_acre, price)
             profit = revenue - other_expenses
-        acres = None
-        total_litres = None
-        water_mm_display = None
     else:
+        acres = request.form.get("acres", type=float)
         if acres is not None:
             if acres <= 0:
                 total_litres = 0
                 water_mm_display = 0
             else:
-                total_litres = acres * 4046.86 * water_mm  # 1 mm = 1 L/m² ; 1 acre = 4046.86 m²
+                total_litres = litres(acres, water_mm)
                 water_mm_display = water_mm
 
     return render_template(
@@ -922,54 +1329,27 @@ def crop_detail(crop_name):
 
 # --- APIs ---
 @app.route('/api/esp32/data')
+@api_login_required
 def esp32_data():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
     try:
-        r = requests.get(ESP32_ENDPOINT, timeout=ESP32_TIMEOUT_S)
-        r.raise_for_status()
-        d = r.json()
+        d = _fetch_esp32()  # keep-alive session; concurrent pollers share one cached read
         # Normalize to your dashboard's IDs/fields
-        return jsonify({
-            "soil_raw": d.get("soil_raw"),
-            "soil_pct": d.get("soil_pct"),
-            "ultrasonic_cm": d.get("ultrasonic_cm"),
-            "temp_c": d.get("temp_c"),
-            "humidity_pct": d.get("humidity_pct"),
-            "pump_on": d.get("pump_on"),
-            "auto_mode": d.get("auto_mode"),
-            "soil_threshold_raw": d.get("soil_threshold_raw"),
-            "ip": d.get("ip"),
-            "uptime_s": d.get("uptime_s"),
-            "wifi_ssid": d.get("wifi_ssid"),
-        })
+        return jsonify({k: d.get(k) for k in ESP32_FIELDS})
     except Exception as e:
         return jsonify({"error": str(e)}), 502
 
 @app.route('/api/run_alerts', methods=['POST'])
+@api_login_required
 def api_run_alerts():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    created = []
-    ra = check_rain_alert()
-    if ra:
-        add_alert(ra)
-        created.append(ra)
-    wa = check_water_tank_alert()
-    if wa:
-        add_alert(wa)
-        created.append(wa)
-    ir = check_weather_irrigation_recommendation()
-    if ir:
-        add_alert(ir)
-        created.append(ir)
+    checks = (check_rain_alert(), check_water_tank_alert(), check_weather_irrigation_recommendation())
+    created = [a for a in checks if a]
+    add_alerts(created)  # one queue item -> one transaction
     return jsonify({'status': 'ok', 'created': created})
 
 
 @app.route('/api/weather_alert', methods=['POST'])
+@api_login_required
 def manual_weather_alert():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
     alert = check_rain_alert()
     if alert:
         add_alert(alert)
@@ -977,10 +1357,8 @@ def manual_weather_alert():
     return jsonify({'status': 'no_alert', 'message': 'No rain alert needed'})
 
 @app.route('/api/water_tank_alert', methods=['POST'])
+@api_login_required
 def manual_water_tank_alert():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-
     alert = check_water_tank_alert()
     if alert:
         add_alert(alert)
@@ -1005,9 +1383,8 @@ def manual_water_tank_alert():
         }), 502
 
 @app.route('/api/weather_irrigation_recommendation', methods=['POST'])
+@api_login_required
 def manual_weather_irrigation_recommendation():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
     alert = check_weather_irrigation_recommendation()
     if alert:
         add_alert(alert)
@@ -1016,10 +1393,8 @@ def manual_weather_irrigation_recommendation():
 
 
 @app.route('/api/add_crop_to_irrigation', methods=['POST'])
+@api_login_required
 def add_crop_to_irrigation():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-
     data = request.json or {}
     crop_name = (data.get('crop_name') or '').strip()
     soil_type = (data.get('soil_type') or '').strip()
@@ -1034,22 +1409,17 @@ def add_crop_to_irrigation():
     if not crop_name or not soil_type or not start_date:
         return jsonify({'error': 'Missing required fields'}), 400
 
-    conn = sqlite3.connect(SQLITE_PATH)
-    cursor = conn.cursor()
+    conn = get_conn()
     try:
-        cursor.execute(
-            """INSERT INTO user_crops (userid, crop_name, soil_type, water_requirement, start_date, status)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (session['userid'], crop_name, soil_type, water_requirement, start_date, 'active')
-        )
-        conn.commit()
+        with conn:
+            cursor = conn.execute(
+                """INSERT INTO user_crops (userid, crop_name, soil_type, water_requirement, start_date, status)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (session['userid'], crop_name, soil_type, water_requirement, start_date, 'active')
+            )
         crop_id = cursor.lastrowid
     except Exception as e:
-        conn.rollback()
-        conn.close()
         return jsonify({'error': f'Database error: {str(e)}'}), 500
-    finally:
-        conn.close()
 
     irrigation_alert = {
         'type': 'irrigation_alert',
@@ -1072,88 +1442,70 @@ def add_crop_to_irrigation():
 
 
 @app.route('/api/alerts')
+@api_login_required
 def get_alerts():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    return jsonify({'alerts': FARMER_ALERTS})
+    return Response(alerts_json(), mimetype='application/json')
 
 
 @app.route('/api/user_crops')
+@api_login_required
 def get_user_crops():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    conn = sqlite3.connect(SQLITE_PATH)
+    conn = get_conn()
     cursor = conn.cursor()
     cursor.execute(
         """SELECT id, crop_name, soil_type, water_requirement, start_date, status, created_at 
            FROM user_crops WHERE userid = ? ORDER BY created_at DESC""",
         (session['userid'],)
     )
-    crops = cursor.fetchall()
-    conn.close()
-    crop_list = [{
-        'id': c[0], 'crop_name': c[1], 'soil_type': c[2], 'water_requirement': c[3],
-        'start_date': c[4], 'status': c[5], 'created_at': c[6]
-    } for c in crops]
+    crop_list = [dict(c) for c in cursor.fetchall()]
     return jsonify({'crops': crop_list})
 
 
 @app.route('/api/user_profile')
+@api_login_required
 def get_user_profile():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    conn = sqlite3.connect(SQLITE_PATH)
+    conn = get_conn()
     cursor = conn.cursor()
     cursor.execute("""SELECT userid, name, phone, created_at FROM users WHERE userid = ?""", (session['userid'],))
     user = cursor.fetchone()
-    conn.close()
     if user:
-        return jsonify({'userid': user[0], 'name': user[1], 'phone': user[2], 'created_at': user[3]})
+        return jsonify(dict(user))
     return jsonify({'error': 'User not found'}), 404
 
 
 @app.route('/api/remove_crop/<int:crop_id>', methods=['DELETE'])
+@api_login_required
 def remove_crop(crop_id):
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    conn = sqlite3.connect(SQLITE_PATH)
+    conn = get_conn()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id FROM user_crops WHERE id = ? AND userid = ?", (crop_id, session['userid']))
-        crop = cursor.fetchone()
-        if not crop:
+        with conn:
+            cursor.execute("DELETE FROM user_crops WHERE id = ? AND userid = ?", (crop_id, session['userid']))
+        if cursor.rowcount == 0:
             return jsonify({'error': 'Crop not found or not authorized'}), 404
-        cursor.execute("DELETE FROM user_crops WHERE id = ? AND userid = ?", (crop_id, session['userid']))
-        conn.commit()
         return jsonify({'status': 'success', 'message': 'Crop deleted successfully'})
     except Exception as e:
-        conn.rollback()
         return jsonify({'error': f'Database error: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 # --- Water sensor control ---
 @app.route('/api/water_control', methods=['POST'])
+@api_login_required
 def water_control():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
     action = request.json.get('action')
     # No real hardware; echo action
     return jsonify({'status': 'success', 'action': action})
 
 
 @app.route('/api/tank_sensor_data', methods=['GET'])
+@api_login_required
 def get_tank_sensor_data():
-    if 'username' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
     simulate_sensor_scenarios()
     level = get_tank_level()
-    capacity = 5000
-    available = int(capacity * level / 100)
+    available = int(TANK_CAPACITY_L * level / 100)
     return jsonify({
         'status': 'success',
-        'tank_level': level, 'tank_capacity': capacity, 'available_water': available,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'tank_level': level, 'tank_capacity': TANK_CAPACITY_L, 'available_water': available,
+        'timestamp': datetime.now().isoformat(sep=' ', timespec='seconds'),
         'sensor_status': 'active'
     })
 
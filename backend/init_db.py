@@ -29,10 +29,13 @@ seed_projects = [
 
 def init():
     conn = sqlite3.connect(DB)
+    conn.execute("PRAGMA journal_mode=WAL")
     c = conn.cursor()
     c.executescript(schema)
-    c.executemany("INSERT INTO projects (title, summary, link) VALUES (?, ?, ?)", seed_projects)
-    conn.commit()
+    # Seed once, in one transaction; re-running init must not duplicate rows
+    with conn:
+        if c.execute("SELECT COUNT(*) FROM projects").fetchone()[0] == 0:
+            c.executemany("INSERT INTO projects (title, summary, link) VALUES (?, ?, ?)", seed_projects)
     conn.close()
     print("Database created and seeded at", DB)
 